@@ -0,0 +1,463 @@
+import gc
+import os
+import tempfile
+import threading
+import typing as t
+import unittest
+from unittest import mock
+
+from toydbms.execution import *
+from toydbms.execution import _rewrite_top_k
+from toydbms.kernels import compile_kernel
+from toydbms.physical import *
+from toydbms.planner import compile_pipeline, literal_contains_needle, order_conjuncts
+from toydbms.query import *
+
+
+TABLE = Table(
+    schema=[
+        ("movieId", UInt32),
+        ("title", Text),
+        ("genres", Text)
+    ],
+    data_path="unused.dat",
+)
+
+VALUES = [
+    ["3", "Heat (1995)", "Action|Crime"],
+    ["1", "Toy Story (1995)", "Adventure|Animation"],
+    ["7", "Sabrina (1995)", "Comedy|Romance"],
+    ["2", "Jumanji (1995)", "Adventure|Children"],
+    ["5", "Father of the Bride Part II (1995)", "Comedy"],
+    ["4", "Waiting to Exhale (1995)", "Comedy|Romance"],
+    ["6", "Grumpier Old Men (1995)", "Comedy|Romance"],
+]
+
+
+def rows(node: Node) -> t.List[t.List[t.Any]]:
+    return [r for batch in node for r in batch]
+
+
+# enough rows to fill many pages, with some genres only in a few pages
+MANY_VALUES = [
+    [str(i % 997), f"Movie {i} ({1900 + i % 120})", "Horror" if 5000 <= i < 5050 else "|".join(
+        ["Action", "Comedy", "Drama", "Romance"][j] for j in range(4) if i % (j + 2) == 0
+    ) or "Documentary"]
+    for i in range(20000)
+]
+
+
+def create_table(
+    test_case: unittest.TestCase,
+    values: t.List[t.List[str]],
+    layout: str = "row",
+    schema: t.Optional[t.List[t.Tuple[str, t.Type[DType]]]] = None,
+) -> Table:
+    """Creates a table in a temporary directory, removed after the test, and
+    inserts values into it."""
+    tmp = tempfile.TemporaryDirectory()
+    test_case.addCleanup(tmp.cleanup)
+    table = Table(schema or TABLE.schema, os.path.join(tmp.name, "table.dat"), layout=layout)
+    test_case.addCleanup(table.close)
+    execute(AbstractCreateTable(table))
+    execute(AbstractInsert(table, values))
+    return table
+
+
+class TestTopKNode(unittest.TestCase):
+    def assert_matches_sort_and_limit(self, sort_columns, k) -> None:
+        want = rows(LimitNode(SortNode(ValuesNode(TABLE, VALUES), sort_columns), k))
+        got = rows(TopKNode(ValuesNode(TABLE, VALUES, batch_size=2), sort_columns, k))
+        self.assertEqual(got, want)
+
+    def test_single_column(self) -> None:
+        self.assert_matches_sort_and_limit([SortColumn("title")], 3)
+        self.assert_matches_sort_and_limit([SortColumn("movieId", False)], 3)
+
+    def test_mixed_directions(self) -> None:
+        self.assert_matches_sort_and_limit(
+            [SortColumn("genres", False), SortColumn("title")], 4
+        )
+        self.assert_matches_sort_and_limit(
+            [SortColumn("genres"), SortColumn("movieId", False)], 4
+        )
+
+    def test_k_larger_than_input(self) -> None:
+        self.assert_matches_sort_and_limit([SortColumn("title")], 100)
+
+    def test_rewrite_limit_over_sort(self) -> None:
+        sort_columns = [SortColumn("genres"), SortColumn("movieId", False)]
+        want = rows(LimitNode(SortNode(ValuesNode(TABLE, VALUES), sort_columns), 3))
+        node = _rewrite_top_k(ProjectionNode(
+            LimitNode(SortNode(ValuesNode(TABLE, VALUES), sort_columns), 3),
+            TABLE.columns,
+        ))
+        self.assertIsInstance(node._child, TopKNode)
+        self.assertEqual(rows(node), want)
+
+
+class TestBatches(unittest.TestCase):
+    def test_limit_slices_across_batches(self) -> None:
+        node = LimitNode(ValuesNode(TABLE, VALUES, batch_size=2), 3)
+        self.assertEqual([len(b) for b in node], [2, 1])
+
+    def test_selection_skips_empty_batches(self) -> None:
+        node = SelectionNode(
+            ValuesNode(TABLE, VALUES, batch_size=2),
+            Filter(["movieId"], lambda m: m > 5),
+        )
+        self.assertEqual(sorted(r[0] for r in rows(node)), [6, 7])
+
+    def test_limit_closes_input_once_satisfied(self) -> None:
+        values = ValuesNode(TABLE, VALUES, batch_size=2)
+        node = LimitNode(values, 2)
+        self.assertEqual(len(next(node)), 2)
+        self.assertEqual(list(values), [])
+
+    def test_limit_closes_scan_once_satisfied(self) -> None:
+        table = create_table(self, MANY_VALUES)
+        scan = FileScanNode(table, batch_size=10)
+        node = LimitNode(scan, 2)
+        self.assertEqual(len(next(node)), 2)
+        self.assertEqual(rows(scan), [])
+
+
+class TestFileScanNode(unittest.TestCase):
+    def test_unknown_column(self) -> None:
+        with mock.patch("sys.unraisablehook") as unraisablehook:
+            with self.assertRaises(KeyError):
+                FileScanNode(TABLE, columns=["nope"])
+            gc.collect()
+        unraisablehook.assert_not_called()
+
+    def test_reader_starts_on_first_read(self) -> None:
+        table = create_table(self, VALUES)
+        threads = threading.active_count()
+        scan = FileScanNode(table)
+        self.assertEqual(threading.active_count(), threads)
+        self.assertEqual(len(rows(scan)), len(VALUES))
+        scan.close()
+        self.assertEqual(threading.active_count(), threads)
+
+
+class TestTable(unittest.TestCase):
+    def test_fd_follows_recreated_file(self) -> None:
+        table = create_table(self, VALUES[:1])
+        other = Table(table.schema, table.data_path)
+        self.addCleanup(other.close)
+        os.unlink(table.data_path)
+        execute(AbstractCreateTable(other))
+        execute(AbstractInsert(table, [VALUES[1]]))
+        self.assertEqual(execute(AbstractQuery(other)), [[1, "Toy Story (1995)", "Adventure|Animation"]])
+
+    def test_insert_rejects_rows_of_wrong_width(self) -> None:
+        table = create_table(self, [])
+        with self.assertRaises(ValueError):
+            execute(AbstractInsert(table, VALUES + [[]]))
+        with self.assertRaises(ValueError):
+            table.encode_batch([[1, "a", "b"], [2, "c"]])
+
+    def test_insert_retries_short_writes(self) -> None:
+        table = create_table(self, [])
+        pwrite = os.pwrite
+        with mock.patch("os.pwrite", lambda fd, data, offset: pwrite(fd, data[:1000], offset)):
+            execute(AbstractInsert(table, MANY_VALUES))
+        self.assertEqual(len(execute(AbstractQuery(table))), len(MANY_VALUES))
+
+
+class TestExecute(unittest.TestCase):
+    """Queries through execute() on tables written to a temporary file,
+    checked against the same query done in Python over the typed rows."""
+
+    NUMS_SCHEMA = [("a", UInt32), ("b", UInt32)]
+    NUMS = [[str(i * 7 % 101), str(i)] for i in range(20000)]
+
+    def assert_query(
+        self,
+        table: Table,
+        values: t.List[t.List[str]],
+        where: t.Optional[t.Union[Filter, Predicate]] = None,
+        select: t.Optional[t.List[str]] = None,
+        order: t.Optional[t.List[SortColumn]] = None,
+        limit: t.Optional[int] = None,
+    ) -> None:
+        want = rows(ValuesNode(table, values))
+        if where is not None:
+            want = [
+                r for r in want
+                if where.predicate(*[r[table.column_index[c]] for c in where.column_args])
+            ]
+        for sc in reversed(order or []):
+            want.sort(key=lambda r: r[table.column_index[sc.column]], reverse=not sc.asc)
+        if limit is not None:
+            want = want[:limit]
+        if select:
+            want = [[r[table.column_index[c]] for c in select] for r in want]
+        got = execute(AbstractQuery(table, select, where, order, limit))
+        if order is None:
+            got, want = sorted(got), sorted(want)
+        self.assertEqual(got, want)
+
+    def test_equality_kernels(self) -> None:
+        for layout in ["row", "pax"]:
+            with self.subTest(layout=layout):
+                nums = create_table(self, self.NUMS, layout, self.NUMS_SCHEMA)
+                movies = create_table(self, MANY_VALUES, layout)
+                for where in [
+                    Cmp("a", "=", 17),
+                    In("b", [3, 19999, 12345, 40000]),
+                    And([Cmp("a", "=", 17), Cmp("b", ">", 9000)]),
+                    And([In("a", [1, 2]), Between("b", 100, 15000), Cmp("a", "!=", 2)]),
+                ]:
+                    self.assert_query(nums, self.NUMS, where)
+                    self.assert_query(nums, self.NUMS, where, select=["b"])
+                    self.assert_query(nums, self.NUMS, where, order=[SortColumn("b", False)], limit=5)
+                for where in [
+                    Cmp("movieId", "=", 500),
+                    And([In("movieId", [3, 996]), Cmp("genres", "=", "Comedy")]),
+                ]:
+                    self.assert_query(movies, MANY_VALUES, where, select=["title"])
+                    self.assert_query(movies, MANY_VALUES, where, order=[SortColumn("title")], limit=3)
+
+    def test_filter_without_columns(self) -> None:
+        for layout in ["row", "pax"]:
+            for schema, values in [(TABLE.schema, VALUES), (self.NUMS_SCHEMA, self.NUMS[:10])]:
+                with self.subTest(layout=layout, schema=schema):
+                    table = create_table(self, values, layout, schema)
+                    self.assert_query(table, values, Filter([], lambda: True))
+                    self.assertEqual(execute(AbstractQuery(table, where_clause=Filter([], lambda: False))), [])
+
+    def test_needle_page_prefilter(self) -> None:
+        # "Horror" is only on a few of the table's pages; the others are
+        # skipped undecoded, which mustn't change the result
+        for layout in ["row", "pax"]:
+            with self.subTest(layout=layout):
+                table = create_table(self, MANY_VALUES, layout)
+                horror = Filter(["genres"], lambda g: "Horror" in g)
+                scan = FileScanNode(table, filter=horror)
+                self.assertEqual(scan._page_needle, b"Horror")
+                got = rows(scan)
+                want = [r for r in rows(FileScanNode(table)) if "Horror" in r[2]]
+                self.assertEqual(len(want), 50)
+                self.assertEqual(got, want)
+
+    def test_pax_table(self) -> None:
+        # each later insert first fills the table's partly full last page
+        table = create_table(self, MANY_VALUES[:1000], "pax")
+        execute(AbstractInsert(table, MANY_VALUES[1000:1003]))
+        execute(AbstractInsert(table, MANY_VALUES[1003:]))
+        self.assertEqual(os.path.getsize(table.data_path) % DEFAULT_PAGE_SIZE, 0)
+        self.assert_query(table, MANY_VALUES)
+        self.assert_query(table, MANY_VALUES, select=["genres", "movieId"])
+        self.assert_query(table, MANY_VALUES, order=[SortColumn("movieId", False), SortColumn("title")], limit=20)
+        self.assert_query(
+            table, MANY_VALUES, Filter(["genres"], lambda g: "Drama" in g),
+            select=["title"], order=[SortColumn("title")], limit=10,
+        )
+        copy = create_table(self, [], "pax")
+        execute(AbstractInsert(copy, from_clause=AbstractQuery(table, where_clause=Cmp("movieId", "<", 10))))
+        self.assertEqual(
+            sorted(execute(AbstractQuery(copy))),
+            sorted(execute(AbstractQuery(table, where_clause=Cmp("movieId", "<", 10)))),
+        )
+
+
+class TestBatchFilter(unittest.TestCase):
+    def test_literal_contains_needle(self) -> None:
+        self.assertEqual(literal_contains_needle(lambda g: "Comedy" in g), "Comedy")
+        self.assertIsNone(literal_contains_needle(lambda g: "Comedy" not in g))
+        self.assertIsNone(literal_contains_needle(lambda g: g in "Comedy"))
+        self.assertIsNone(literal_contains_needle(lambda g: "Comedy" in g.lower()))
+        self.assertIsNone(literal_contains_needle(lambda m, g: "Comedy" in g))
+
+    def test_specialized_filter_matches_predicate(self) -> None:
+        for predicate in [lambda g: "Comedy" in g, lambda g: "Comedy" not in g]:
+            node = SelectionNode(ValuesNode(TABLE, VALUES), Filter(["genres"], predicate))
+            want = [r for r in rows(ValuesNode(TABLE, VALUES)) if predicate(r[2])]
+            self.assertEqual(rows(node), want)
+
+
+class TestSortNode(unittest.TestCase):
+    def test_mixed_direction_runs(self) -> None:
+        sort_columns = [
+            SortColumn("genres", False),
+            SortColumn("movieId", False),
+            SortColumn("title"),
+        ]
+        want = rows(ValuesNode(TABLE, VALUES))
+        for sc in reversed(sort_columns):
+            want.sort(key=lambda r: r[TABLE.column_index[sc.column]], reverse=not sc.asc)
+        got = rows(SortNode(ValuesNode(TABLE, VALUES, batch_size=2), sort_columns))
+        self.assertEqual(got, want)
+
+
+class TestColumnBatch(unittest.TestCase):
+    def test_read_columns_late_materialization(self) -> None:
+        page = HeapPage(TABLE.schema)
+        for row in rows(ValuesNode(TABLE, VALUES)):
+            page.insert_record(row)
+        genres = page.read_columns([2])
+        positions = [k for k, g in enumerate(genres.columns[2]) if "Romance" in g]
+        batch = genres.take(positions)
+        batch.columns.update(page.read_columns([0], positions).columns)
+        self.assertEqual(
+            batch.rows(3),
+            [[r[0], None, r[2]] for r in rows(ValuesNode(TABLE, VALUES)) if "Romance" in r[2]],
+        )
+
+    def test_fixed_width_page_decode(self) -> None:
+        schema = [("a", UInt32), ("b", UInt32), ("c", UInt32)]
+        page = HeapPage(schema)
+        records = [[i, i * 7, 2 ** 32 - 1 - i] for i in range(50)]
+        for record in records:
+            page.insert_record(record)
+        self.assertEqual(list(page), records)
+        self.assertEqual(page.read_records(), records)
+        batch = page.read_columns([0, 2])
+        self.assertEqual(batch.rows(3), [[a, None, c] for a, _, c in records])
+        self.assertEqual(page.read_records({1}), [[None, b, None] for _, b, _ in records])
+
+    def test_read_only_page(self) -> None:
+        records = rows(ValuesNode(TABLE, VALUES))
+        for page_type in [HeapPage, ColumnarHeapPage]:
+            page = page_type(TABLE.schema)
+            for record in records:
+                page.insert_record(record)
+            view = memoryview(page.marshall())
+            page = page_type(TABLE.schema, init_buff=view, read_only=True)
+            self.assertEqual(page.read_records(), records)
+            with self.assertRaises(ValueError):
+                page.insert_record(records[0])
+
+
+class TestColumnarHeapPage(unittest.TestCase):
+    def test_round_trip(self) -> None:
+        records = rows(ValuesNode(TABLE, VALUES))
+        page = ColumnarHeapPage(TABLE.schema)
+        for record_bin in TABLE.encode_batch(records[:4]):
+            page.insert_record_bytes(record_bin)
+        # reload from bytes and keep inserting, as InsertNode does
+        page = ColumnarHeapPage(TABLE.schema, init_buff=page.marshall())
+        for record in records[4:]:
+            page.insert_record(record)
+        page.reset(page.marshall())
+        self.assertEqual(list(page), records)
+        self.assertEqual(page.read_records({0}), [[r[0], None, None] for r in records])
+        self.assertEqual(page.read_columns([1], [0, 2]).columns[1], [records[0][1], records[2][1]])
+
+    def test_insufficient_space(self) -> None:
+        page = ColumnarHeapPage(TABLE.schema, page_size=64)
+        with self.assertRaises(InsufficientSpaceError):
+            for record in rows(ValuesNode(TABLE, VALUES)):
+                page.insert_record(record)
+        self.assertEqual(len(page.marshall()), 64)
+
+
+class TestPredicate(unittest.TestCase):
+    def test_compiled_matches_predicate_function(self) -> None:
+        for predicate in [
+            Cmp("movieId", ">=", 4),
+            Between("movieId", 2, 5),
+            In("genres", ["Comedy", "Action|Crime"]),
+            And([Cmp("movieId", "!=", 4), Cmp("genres", "=", "Comedy|Romance")]),
+            Or([Cmp("title", "<", "H"), And([Cmp("movieId", "<", 3), In("movieId", {2})])]),
+        ]:
+            args = [TABLE.column_index[col] for col in predicate.column_args]
+            want = [
+                r for r in rows(ValuesNode(TABLE, VALUES))
+                if predicate.predicate(*[r[i] for i in args])
+            ]
+            self.assertTrue(want)
+            self.assertEqual(rows(SelectionNode(ValuesNode(TABLE, VALUES), predicate)), want)
+
+    def test_conjunct_order(self) -> None:
+        opaque = Filter(["movieId"], lambda m: m > 1)
+        text_range = Cmp("title", ">", "H")
+        int_range = Between("movieId", 2, 5)
+        member = In("genres", ["Comedy"])
+        equal = Cmp("genres", "=", "Comedy")
+        predicate = And([opaque, text_range, And([int_range, member]), equal])
+        self.assertEqual(
+            order_conjuncts(TABLE, predicate),
+            [equal, member, int_range, text_range, opaque],
+        )
+
+    def test_unknown_operator(self) -> None:
+        with self.assertRaises(ValueError):
+            Cmp("movieId", "<>", 4)
+
+    def test_empty_connective(self) -> None:
+        with self.assertRaises(ValueError):
+            And([])
+        with self.assertRaises(ValueError):
+            Or([])
+
+
+class TestPipeline(unittest.TestCase):
+    def test_matches_record_decode(self) -> None:
+        records = rows(ValuesNode(TABLE, VALUES))
+        page = HeapPage(TABLE.schema)
+        for record in records:
+            page.insert_record(record)
+        genres = Filter(["genres"], lambda g: "Comedy" in g)
+        both = And([In("genres", ["Comedy|Romance"]), Cmp("movieId", ">", 4)])
+        either = Or([Cmp("movieId", "<", 3), Cmp("genres", "=", "Drama")])
+        cases = [
+            (None, None, None, records),
+            (None, ["movieId"], None, [[r[0], None, None] for r in records]),
+            (genres, None, ["title"], [[r[1]] for r in records if "Comedy" in r[2]]),
+            (both, None, ["genres", "movieId"], [[r[2], r[0]] for r in records if r[0] > 4 and r[2] == "Comedy|Romance"]),
+            (either, None, ["title"], [[r[1]] for r in records if r[0] < 3 or r[2] == "Drama"]),
+        ]
+        for filter, columns, projection, want in cases:
+            pipeline = compile_pipeline(TABLE, filter, columns, projection)
+            self.assertEqual(page.run(pipeline), want)
+
+    def test_unsupported_tables(self) -> None:
+        self.assertIsNone(compile_pipeline(Table(TABLE.schema, "unused.dat", layout="pax")))
+        self.assertIsNone(compile_pipeline(Table([("a", UInt32)], "unused.dat")))
+
+
+class TestKernels(unittest.TestCase):
+    def test_equality_kernels_match_predicate(self) -> None:
+        table = Table([("a", UInt32), ("b", UInt32)], "unused.dat")
+        records = [[i % 5, i] for i in range(40)]
+        for page_type in [HeapPage, ColumnarHeapPage]:
+            page = page_type(table.schema)
+            for record in records:
+                page.insert_record(record)
+            buff = page.marshall()
+            page.reset(buff)
+            for predicate in [Cmp("a", "=", 3), In("b", [7, 0, 39, -1]), Cmp("b", "=", 1 << 40)]:
+                column, kernel = compile_kernel(table, predicate)
+                start, stride, count, reverse = page.column_span(column)
+                positions = kernel(buff, start, stride, count)
+                if reverse:
+                    positions = [count - 1 - k for k in reversed(positions)]
+                want = [k for k, r in enumerate(records) if predicate.predicate(r[column])]
+                self.assertEqual(positions, want)
+
+    def test_unsupported_conjuncts(self) -> None:
+        self.assertIsNone(compile_kernel(TABLE, Cmp("title", "=", "Heat (1995)")))
+        self.assertIsNone(compile_kernel(TABLE, Cmp("movieId", ">", 3)))
+        self.assertIsNone(compile_kernel(TABLE, Filter(["movieId"], lambda m: m == 3)))
+
+
+class TestDTypes(unittest.TestCase):
+    def test_text_unmarshall_from(self) -> None:
+        buff = b"".join(Text.marshall(v) for v in ["", "ça", "Heat (1995)"])
+        values, offset = [], 0
+        while offset < len(buff):
+            value, offset = Text.unmarshall_from(buff, offset)
+            values.append(value)
+        self.assertEqual(values, ["", "ça", "Heat (1995)"])
+
+    def test_unmarshall_from_and_skip_from(self) -> None:
+        buff = UInt32.marshall(7) + Text.marshall("ça") + UInt32.marshall(2**32 - 1)
+        value, offset = UInt32.unmarshall_from(buff, 0)
+        self.assertEqual((value, offset), (7, 4))
+        self.assertEqual(Text.skip_from(buff, offset), 4 + len(Text.marshall("ça")))
+        offset = Text.skip_from(buff, offset)
+        self.assertEqual(UInt32.unmarshall_from(buff, offset), (2**32 - 1, len(buff)))
+        # the DType default goes through unmarshall
+        self.assertEqual(DType.unmarshall_from.__func__(Text, buff, 4), ("ça", offset))
@@ -29,14 +29,13 @@ class TestIntegration(unittest.TestCase):
     def load_csv_table_to_heapfile(tablename: str, csv_path: str) -> None:
         table = DATABASE[tablename]
         execute(AbstractCreateTable(table))
-        with open(csv_path, 'r') as fi:
+        with open(csv_path, 'r', newline='') as fi:
             reader = csv.reader(fi)
             # skip header
             next(reader)
-            # TODO: could chunk this to avoid materializing all
-            # records for load
-            values = [r for r in reader]
-            execute(AbstractInsert(table, values))
+            # stream rows straight from the reader rather than materializing
+            # all records for load
+            execute(AbstractInsert(table, reader))
 
     @classmethod
     def setUpClass(cls):
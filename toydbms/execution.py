@@ -1,9 +1,22 @@
+import heapq
+import itertools
 import os
+import queue
+import threading
 import typing as t
 from abc import ABC, abstractmethod
-from io import BytesIO, SEEK_END
-
-from toydbms.physical import HeapPage, InsufficientSpaceError
+from operator import itemgetter
+
+from toydbms.kernels import compile_kernel
+from toydbms.physical import HeapPage, InsufficientSpaceError, Text, UInt32
+from toydbms.planner import (
+    Batch,
+    compile_batch_plan,
+    compile_pipeline,
+    compile_selection,
+    literal_contains_needle,
+    order_conjuncts,
+)
 from toydbms.query import (
     AbstractCreateTable,
     AbstractDDLStatement,
@@ -12,16 +25,30 @@ from toydbms.query import (
     AbstractStatement,
     AbstractQuery,
     Filter,
+    Predicate,
     SortColumn,
-    Table
+    Table,
+    bind_expression,
 )
 
 
 DEFAULT_PAGE_SIZE = 4096
+DEFAULT_BATCH_SIZE = 1024
+# Scans read roughly this many bytes per syscall (rounded down to whole pages)
+# on a background thread, so sequential page reads are served from memory
+SCAN_BUFFER_SIZE = 1 << 20
+# Max chunks a scan's background reader gets ahead of the consumer
+READ_AHEAD_DEPTH = 4
+# Inserts collect full pages and write them in chunks of at least this size
+INSERT_BUFFER_SIZE = 1 << 20
 
 
 class Node(ABC):
-    """The base Node interface is equivalent to the iterator interface."""
+    """The base Node interface is equivalent to the iterator interface.
+
+    Each __next__ call returns a non-empty batch of rows rather than a single
+    row, so per-call interpreter overhead is amortized across the batch.
+    """
 
     def __init__(self, child: "Node"):
         self._child = child
@@ -36,19 +63,184 @@ class Node(ABC):
         return self
 
     @abstractmethod
-    def __next__(self) -> t.List[t.Any]:
+    def __next__(self) -> Batch:
         pass
 
+    def close(self) -> None:
+        """Releases resources held by this node and its inputs.
+
+        Called once no more batches will be pulled; leaf nodes override this
+        to release their input, and iterating a closed chain stops.
+        """
+        if self._child is not self:
+            self._child.close()
+
+
+class _ReadAhead:
+    """Reads a file in large chunks on a background thread.
+
+    Chunks are handed over through a bounded queue, so file I/O (which releases
+    the GIL) overlaps with decoding on the consuming thread. Reads are
+    os.pread calls at an offset tracked here, on a descriptor of the reader's
+    own, so there's no file object buffering or shared file position.
+    """
+
+    def __init__(self, path: str, chunk_size: int, depth: int = READ_AHEAD_DEPTH):
+        self._fd = os.open(path, os.O_RDONLY)
+        # tell the kernel the whole file is read sequentially, so it reads
+        # further ahead of us (not available on all platforms, e.g. macOS)
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self._fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        self._chunk_size = chunk_size
+        self._chunks = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._done = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _put(self, item: t.Union[bytes, BaseException]) -> bool:
+        """Blocks until item is queued, giving up if the reader is closed."""
+        while not self._stop.is_set():
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self) -> None:
+        try:
+            offset = 0
+            while True:
+                chunk = os.pread(self._fd, self._chunk_size, offset)
+                offset += len(chunk)
+                if not self._put(chunk) or not chunk:
+                    return
+        except BaseException as e:
+            self._put(e)
+
+    def read(self) -> bytes:
+        """Returns the next chunk, or b"" once the file is exhausted or closed."""
+        if self._done:
+            return b""
+        item = self._chunks.get()
+        if isinstance(item, BaseException):
+            self._done = True
+            raise item
+        if not item:
+            self._done = True
+        return item
+
+    def close(self) -> None:
+        if self._fd is None:
+            return
+        self._done = True
+        self._stop.set()
+        self._thread.join()
+        os.close(self._fd)
+        self._fd = None
+
 
 class FileScanNode(Node):
-    """Scans an on-disk database table."""
+    """Scans an on-disk database table.
+
+    Rows from consecutive pages are gathered until a batch holds at least
+    batch_size rows (or the table ends), so small or highly filtered pages
+    don't each cost a trip through the operators above.
+
+    An optional filter is evaluated column-at-a-time: each page first decodes
+    only the filter's argument columns, computes the surviving positions, and
+    then decodes the remaining columns for survivors alone, so rows that fail
+    never have their other fields decoded or a row list built. Conjuncts of an
+    And run one after another, cheapest first, each on the positions left by
+    the ones before it. An optional projection is applied inline by a
+    generated function per batch, saving the ProjectionNode hop. Only push a
+    projection down when nothing above the scan needs the other columns.
+
+    Row layout tables with Text columns skip all of that: decode, filter and
+    projection run as one generated loop over each page's records (see
+    planner.compile_pipeline).
+
+    For a `"literal" in text_column` filter, each raw page is first searched for
+    the UTF-8 encoded literal; pages without it can't match any row and are
+    skipped without decoding a single record.
+
+    If columns is given, only those columns are decoded and the others are
+    left as None in each row, so downstream column indexes are unchanged. With
+    the table's "pax" layout, that also skips the other columns' bytes.
+    """
 
-    def __init__(self, table: Table, page_size: int = DEFAULT_PAGE_SIZE):
+    def __init__(
+            self,
+            table: Table,
+            page_size: int = DEFAULT_PAGE_SIZE,
+            filter: t.Optional[t.Union[Filter, Predicate]] = None,
+            columns: t.Optional[t.Collection[str]] = None,
+            projection: t.Optional[t.List[str]] = None,
+            batch_size: int = DEFAULT_BATCH_SIZE,
+        ):
+        # the read-ahead thread is only started by the first read, so a scan
+        # that is built but never (or not yet) iterated holds no thread or fd.
+        # These are set first, as __del__ closes even a scan whose __init__
+        # raised (e.g. on an unknown column)
+        self._reader = None
+        self._closed = False
+        self._chunk = b""
+        self._chunk_view = memoryview(self._chunk)
+        self._offset = 0
+        self._page_start = 0
         self._input_table = table
         self._page_size = page_size
-        self._file = open(table.data_path, 'rb')
+        self._batch_size = batch_size
+        self._column_idxs = None
+        if columns is not None or projection is not None:
+            needed = set(columns or ()) | set(projection or ())
+            if filter is not None:
+                needed.update(filter.column_args)
+            self._column_idxs = {table.column_index[col] for col in needed}
         self._child = self
-        self._page = None
+        # one page object is reloaded for every page read by the scan. It only
+        # references the read buffer (no copy) when every column it decodes is
+        # fixed width, since Text decodes faster from a private copy
+        decoded = range(len(table.schema)) if self._column_idxs is None else self._column_idxs
+        read_only = all(table.schema[i][1].struct_format is not None for i in decoded)
+        self._page = table.page_type(table.schema, page_size, read_only=read_only)
+        # a generated per-page pipeline does the decode, filter and projection
+        # in one loop when the table supports it; otherwise pages go through
+        # the column-at-a-time stages and the projection plan below
+        self._pipeline = compile_pipeline(table, filter, columns, projection)
+        self._plan = None
+        if projection is not None and self._pipeline is None:
+            self._plan = compile_batch_plan(table, projection=projection)
+        # column-at-a-time filter stages: the columns first decoded by each
+        # conjunct (cheapest first) and its compiled selection
+        self._stages = []
+        self._kernel = None
+        if filter is not None and self._pipeline is None:
+            decoded = set()
+            conjuncts = order_conjuncts(table, filter)
+            for conjunct in conjuncts:
+                idxs = {table.column_index[col] for col in conjunct.column_args}
+                self._stages.append((idxs - decoded, compile_selection(table, conjunct)))
+                decoded |= idxs
+            # the first conjunct may instead run as a kernel over raw bytes
+            self._kernel = compile_kernel(table, conjuncts[0])
+            needed = (
+                range(len(table.schema)) if self._column_idxs is None
+                else self._column_idxs
+            )
+            self._rest_idxs = set(needed) - decoded
+        self._page_needle = None
+        if filter is not None:
+            needle = None
+            if not isinstance(filter, Predicate):
+                needle = literal_contains_needle(filter.predicate)
+            if (
+                needle is not None
+                and len(filter.column_args) == 1
+                and dict(table.schema)[filter.column_args[0]] is Text
+            ):
+                self._page_needle = needle.encode("utf8")
 
     @property
     def table(self) -> Table:
@@ -57,46 +249,161 @@ class FileScanNode(Node):
     def __iter__(self):
         return self
 
-    def __next__(self) -> t.List[t.Any]:
-        while True:
-            if self._page is None:
-                page_bin = self._file.read(self._page_size)
-                if len(page_bin) == 0:
-                    raise StopIteration
-                elif len(page_bin) != self._page_size:
-                    raise ValueError("heapfile size isn't multiple of page size") 
-                self._page = HeapPage(self._input_table.schema, init_buff=page_bin)
-            try:
-                return next(self._page)
-            except StopIteration:
-                self._page = None
+    def _next_page(self) -> t.Optional[memoryview]:
+        """Returns the next page as a zero-copy view into the current chunk.
+
+        Returns None at the end of the file, and an empty page for a page the
+        needle prefilter rules out (searched in place within the chunk).
+        """
+        if self._offset >= len(self._chunk):
+            if self._reader is None:
+                if self._closed:
+                    return None
+                self._reader = _ReadAhead(
+                    self._input_table.data_path,
+                    max(1, SCAN_BUFFER_SIZE // self._page_size) * self._page_size,
+                )
+            self._chunk = self._reader.read()
+            self._chunk_view = memoryview(self._chunk)
+            self._offset = 0
+            if len(self._chunk) == 0:
+                return None
+            elif len(self._chunk) % self._page_size != 0:
+                raise ValueError("heapfile size isn't multiple of page size") 
+        page_start = self._page_start = self._offset
+        self._offset += self._page_size
+        if (
+            self._page_needle is not None
+            and self._chunk.find(self._page_needle, page_start, self._offset) == -1
+        ):
+            return b""
+        return self._chunk_view[page_start:self._offset]
+
+    def __next__(self) -> Batch:
+        batch = []
+        while len(batch) < self._batch_size:
+            page_bin = self._next_page()
+            if page_bin is None:
+                break
+            if not page_bin:
+                # skipped by the needle prefilter
                 continue
+            self._page.reset(page_bin)
+            if self._pipeline is not None:
+                rows = self._page.run(self._pipeline)
+            elif not self._stages:
+                rows = self._page.read_records(self._column_idxs)
+            else:
+                rows = self._read_selected_rows(self._page)
+            if self._plan is not None:
+                rows = self._plan(rows)
+            batch += rows
+        if not batch:
+            raise StopIteration
+        return batch
+
+    def _read_selected_rows(self, page: HeapPage) -> Batch:
+        """Narrows the page's records conjunct by conjunct, decoding each newly
+        needed column only for the records still selected, then decodes the
+        rest of the row for the survivors."""
+        stages = iter(self._stages)
+        idxs, select = next(stages)
+        span = None if self._kernel is None else page.column_span(self._kernel[0])
+        if span is None:
+            selected = page.read_columns(idxs)
+            positions = select(selected)
+            selected = selected.take(positions)
+        else:
+            start, stride, count, reverse = span
+            # the chunk holds the same bytes as the page, and supports find
+            positions = self._kernel[1](self._chunk, self._page_start + start, stride, count)
+            if reverse:
+                positions = [count - 1 - k for k in reversed(positions)]
+            selected = page.read_columns(idxs, positions)
+        for idxs, select in stages:
+            if not positions:
+                return []
+            if idxs:
+                selected.columns.update(page.read_columns(idxs, positions).columns)
+            kept = select(selected)
+            positions = [positions[k] for k in kept]
+            selected = selected.take(kept)
+        if not positions:
+            return []
+        if self._rest_idxs:
+            selected.columns.update(page.read_columns(self._rest_idxs, positions).columns)
+        return selected.rows(len(self._input_table.schema))
+
+    def close(self) -> None:
+        self._closed = True
+        if self._reader is not None:
+            self._reader.close()
+        # drop the pages left in the current chunk too, so iterating stops
+        self._chunk = b""
+        self._chunk_view = memoryview(self._chunk)
+        self._offset = 0
 
     def __del__(self):
-        self._file.close()
+        self.close()
 
 
 class ValuesNode(Node):
-    """Represents a list of values in a query as a node."""
-    def __init__(self, table: Table, values: t.List[t.List[str]]):
+    """Represents a list of values in a query as a node.
+
+    Values are consumed lazily, so any iterable of rows (e.g. a csv.reader) can
+    be inserted while holding only one batch in memory.
+    """
+    def __init__(
+            self,
+            table: Table,
+            values: t.Iterable[t.List[str]],
+            batch_size: int = DEFAULT_BATCH_SIZE,
+        ):
         self._table = table
         self._child = self
-        self._values = values
-        self._idx = 0
-    
+        self._values = iter(values)
+        self._batch_size = batch_size
+        # resolved once per node; Text values are already str, so their column
+        # is passed through rather than mapping an identity from_str over it
+        self._from_strs = [
+            None if dtype is Text else dtype.from_str for _, dtype in table.schema
+        ]
+
+    @property
+    def table(self) -> Table:
+        return self._table
+
     def __iter__(self):
         return self
 
-    def __next__(self) -> t.List[t.Any]:
-        try:
-            record = [
-                dtype.from_str(val)
-                for (_, dtype), val in zip(self._table.schema, self._values[self._idx])
-            ]
-            self._idx += 1
-            return record
-        except IndexError:
+    def __next__(self) -> Batch:
+        values = list(itertools.islice(self._values, self._batch_size))
+        if not values:
             raise StopIteration
+        self._table.check_row_widths(values)
+        # convert column-at-a-time so each dtype's from_str is mapped over a
+        # whole column, then zip the typed columns back into rows
+        columns = [
+            column if from_str is None else map(from_str, column)
+            for from_str, column in zip(self._from_strs, zip(*values))
+        ]
+        return list(map(list, zip(*columns)))
+
+    def close(self) -> None:
+        self._values = iter(())
+
+
+def _pwrite_all(fd: int, data: bytes, offset: int) -> int:
+    """Writes all of data at offset, retrying short writes; returns the offset
+    just past it."""
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        if written == 0:
+            raise OSError(f"pwrite wrote no bytes at offset {offset}")
+        view = view[written:]
+        offset += written
+    return offset
 
 
 class InsertNode(Node):
@@ -111,6 +418,7 @@ class InsertNode(Node):
         self._child = child
         self._page_size = page_size
         self._num_inserted = 0
+        self._done = False
 
     @property
     def table(self) -> Table:
@@ -119,26 +427,33 @@ class InsertNode(Node):
     def __iter__(self):
         return self
     
-    def __next__(self) -> t.List[t.Any]:
+    def __next__(self) -> Batch:
         """For now, process all inserts in one batch and return num inserted."""
-        if self._num_inserted > 0:
+        if self._done:
             raise StopIteration
-        with open(self._dest_table.data_path, 'rb+') as f:
-            # initialize with last page in the table
-            f.seek(-self._page_size, SEEK_END)
-            page = HeapPage(self._dest_table.schema, init_buff=f.read(self._page_size))
-            f.seek(-self._page_size, SEEK_END)
-            for record in self._child:
+        self._done = True
+        fd = self._dest_table.fd
+        # initialize with last page in the table
+        offset = os.fstat(fd).st_size - self._page_size
+        page_type = self._dest_table.page_type
+        page = page_type(self._dest_table.schema, init_buff=os.pread(fd, self._page_size, offset))
+        out = bytearray()
+        for batch in self._child:
+            for record_bin in self._dest_table.encode_batch(batch):
                 try:
-                    page.insert_record(record)
+                    page.insert_record_bytes(record_bin)
                 except InsufficientSpaceError:
-                    f.write(page.marshall())
-                    page = HeapPage(self._dest_table.schema)
-                    page.insert_record(record)
-                self._num_inserted += 1
-            if page.num_records > 0:
-                f.write(page.marshall())
-            return [self._num_inserted]
+                    out += page.marshall()
+                    page = page_type(self._dest_table.schema, self._page_size)
+                    page.insert_record_bytes(record_bin)
+            self._num_inserted += len(batch)
+            if len(out) >= INSERT_BUFFER_SIZE:
+                offset = _pwrite_all(fd, out, offset)
+                out.clear()
+        if page.num_records > 0:
+            out += page.marshall()
+        _pwrite_all(fd, out, offset)
+        return [[self._num_inserted]]
 
 
 class ProjectionNode(Node):
@@ -148,34 +463,37 @@ class ProjectionNode(Node):
         projection_columns: t.List[str],
     ):
         self._child = child
-        self.projection_col_idxs = [
-            self.table.columns.index(col) for col in projection_columns
-        ]
+        self.projection_col_idxs = tuple(
+            self.table.column_index[col] for col in projection_columns
+        )
+        # a generated [[row[i], row[j]] for row in batch] comprehension, which
+        # measures faster than mapping an itemgetter and list over the batch
+        self._project = compile_batch_plan(self.table, projection=projection_columns)
 
     def __iter__(self):
         return self
 
-    def __next__(self) -> t.List[t.Any]:
-        row = next(self._child)
-        return [row[i] for i in self.projection_col_idxs]
+    def __next__(self) -> Batch:
+        return self._project(next(self._child))
 
 
 class SelectionNode(Node):
-    def __init__(self, child: Node, filter: Filter):
+    def __init__(self, child: Node, filter: t.Union[Filter, Predicate]):
         self._child = child
         self.filter = filter
-        self.col_arg_idxs = [
-            self.table.columns.index(col) for col in filter.column_args
-        ]
+        self.col_arg_idxs = tuple(
+            self.table.column_index[col] for col in filter.column_args
+        )
+        self._filter_batch = compile_batch_plan(self.table, filter)
 
     def __iter__(self):
         return self
 
-    def __next__(self) -> t.List[t.Any]:
+    def __next__(self) -> Batch:
         while True:
-            row = next(self._child)
-            if self.filter.predicate(*[row[i] for i in self.col_arg_idxs]):
-                return row
+            batch = self._filter_batch(next(self._child))
+            if batch:
+                return batch
 
 
 class LimitNode(Node):
@@ -186,39 +504,138 @@ class LimitNode(Node):
     def __iter__(self):
         return self
 
-    def __next__(self) -> t.List[t.Any]:
+    def __next__(self) -> Batch:
         if self.limit <= 0:
             raise StopIteration
-        self.limit -= 1
-        return next(self._child)
+        batch = next(self._child)[:self.limit]
+        self.limit -= len(batch)
+        if self.limit <= 0:
+            # nothing more will be pulled, so stop the input (e.g. the scan's
+            # file) right away rather than whenever the chain is collected
+            self._child.close()
+        return batch
+
+
+class _Reversed:
+    """Wraps a sort key value so it compares in descending order."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: t.Any):
+        self.value = value
+
+    def __lt__(self, other: "_Reversed") -> bool:
+        return other.value < self.value
+
+    def __eq__(self, other: "_Reversed") -> bool:
+        return self.value == other.value
+
+
+def _sort_key(
+    table: Table, sort_columns: t.List[SortColumn]
+) -> t.Tuple[t.Callable[[t.List[t.Any]], t.Any], bool]:
+    """Builds a single key function for a multi-column sort.
+
+    Returns (key, descending). When every column sorts in the same direction the
+    key is a plain itemgetter and the direction is handled by the caller, so only
+    mixed directions pay for negation (UInt32) or _Reversed wrappers (others).
+    """
+    idxs = [table.column_index[sc.column] for sc in sort_columns]
+    if all(sc.asc for sc in sort_columns):
+        return itemgetter(*idxs), False
+    if not any(sc.asc for sc in sort_columns):
+        return itemgetter(*idxs), True
+    # mixed directions: generate the key tuple expression inline
+    dtypes = dict(table.schema)
+    parts = []
+    consts = []
+    for idx, sc in zip(idxs, sort_columns):
+        if sc.asc:
+            parts.append(f"row[{idx}]")
+        elif dtypes[sc.column] is UInt32:
+            parts.append(f"-row[{idx}]")
+        else:
+            consts.append(_Reversed)
+            parts.append(f"c{len(consts) - 1}(row[{idx}])")
+    return bind_expression(f"({', '.join(parts)})", ["row"], consts), False
+
+
+def _iter_batches(rows: t.List[t.List[t.Any]], batch_size: int) -> t.Iterator[Batch]:
+    """Yields rows, in order, as consecutive slices of at most batch_size."""
+    for start in range(0, len(rows), batch_size):
+        yield rows[start:start + batch_size]
 
 
 class SortNode(Node):
-    def __init__(self, child: Node, sort_columns: t.List[SortColumn]):
+    def __init__(
+            self,
+            child: Node,
+            sort_columns: t.List[SortColumn],
+            batch_size: int = DEFAULT_BATCH_SIZE,
+        ):
         self._child = child
         self.sort_columns = sort_columns
-        # Store reverse sorted rows so they can be popped when node is iterated
-        self.reverse_sorted_rows = None
+        self._batch_size = batch_size
+        self.sorted_rows = None
+        self._batches = None
 
     def _init_sorted_rows(self) -> None:
-        rows = [r for r in self._child]
-        # sort in opposite order of specifed columns for correct pecedence
-        for sort_column in reversed(self.sort_columns):
-            col_idx = self.table.columns.index(sort_column.column)
-            # reverse sort order so iteration can pop from tail
-            rows.sort(key=lambda r: r[col_idx], reverse=sort_column.asc)
-        self.reverse_sorted_rows = rows
+        rows = [r for batch in self._child for r in batch]
+        self._child.close()
+        # lexicographic sort as one stable pass per column, least significant
+        # first (what a lexsort does). Each pass keys on a bare column value,
+        # which CPython compares far faster than key tuples, and reverse=True
+        # keeps equal rows in order, so descending needs no key wrapping
+        for sc in reversed(self.sort_columns):
+            rows.sort(key=itemgetter(self.table.column_index[sc.column]), reverse=not sc.asc)
+        self.sorted_rows = rows
+        self._batches = _iter_batches(rows, self._batch_size)
 
     def __iter__(self):
         return self
 
-    def __next__(self) -> t.List[t.Any]:
-        if self.reverse_sorted_rows is None:
+    def __next__(self) -> Batch:
+        if self._batches is None:
             self._init_sorted_rows()
-        if not self.reverse_sorted_rows:
-            raise StopIteration
-        return self.reverse_sorted_rows.pop()
-    
+        return next(self._batches)
+
+
+class TopKNode(Node):
+    """Fused Sort + Limit that only retains the best k rows.
+
+    Uses a bounded heap (heapq.nsmallest/nlargest), so work is O(N log k) and
+    memory is O(k) instead of materializing and sorting every input row.
+    """
+    def __init__(
+            self,
+            child: Node,
+            sort_columns: t.List[SortColumn],
+            k: int,
+            batch_size: int = DEFAULT_BATCH_SIZE,
+        ):
+        self._child = child
+        self.sort_columns = sort_columns
+        self.k = k
+        self._batch_size = batch_size
+        self._key, self._descending = _sort_key(self.table, sort_columns)
+        self.top_rows = None
+        self._batches = None
+
+    def _init_top_rows(self) -> None:
+        select = heapq.nlargest if self._descending else heapq.nsmallest
+        rows = itertools.chain.from_iterable(self._child)
+        self.top_rows = select(self.k, rows, key=self._key)
+        self._child.close()
+        self._batches = _iter_batches(self.top_rows, self._batch_size)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Batch:
+        if self._batches is None:
+            self._init_top_rows()
+        return next(self._batches)
+
 
 def execute_ddl(s: AbstractDDLStatement) -> None:
     if isinstance(s, AbstractCreateTable):
@@ -227,24 +644,58 @@ def execute_ddl(s: AbstractDDLStatement) -> None:
         # is already at the specified path
         if os.path.exists(s.table.data_path):
             raise ValueError(f"Table {s.table.data_path} already exists")
+        # drop any descriptor still open on a previous file at this path
+        s.table.close()
         with open(s.table.data_path, 'wb') as fo:
-            page = HeapPage(s.table.schema)
+            page = s.table.page_type(s.table.schema)
             fo.write(page.marshall())
     else:
         raise ValueError(f"Received unrecognized AbstractDDLStatement type: {type(s)}")
     
 
-def _get_abstract_query_entry_node(s: AbstractQuery) -> Node:
-    entry_node = FileScanNode(s.from_clause)
-    if s.where_clause is not None:
-        entry_node = SelectionNode(entry_node, s.where_clause)
+def _get_scan_columns(s: AbstractQuery) -> t.Optional[t.Set[str]]:
+    """Columns read above the scan, or None if every column is needed.
+
+    FileScanNode adds the filter's columns itself.
+    """
+    if not s.select_clause:
+        return None
+    columns = set(s.select_clause)
     if s.order_clause:
-        entry_node = SortNode(entry_node, s.order_clause)
+        columns.update(sc.column for sc in s.order_clause)
+    return columns
+
+
+def _rewrite_top_k(node: Node) -> Node:
+    """Planner pass replacing each LimitNode directly over a SortNode with a
+    TopKNode, so only the best limit rows are ever kept and ordered."""
+    if isinstance(node, LimitNode) and isinstance(node._child, SortNode):
+        sort = node._child
+        return TopKNode(_rewrite_top_k(sort._child), sort.sort_columns, node.limit)
+    if node._child is not node:
+        node._child = _rewrite_top_k(node._child)
+    return node
+
+
+def _get_abstract_query_entry_node(s: AbstractQuery) -> Node:
+    if not s.order_clause:
+        # without a sort, projection commutes with limit and is fused into the
+        # scan's generated per-batch plan along with the filter
+        entry_node = FileScanNode(
+            s.from_clause, filter=s.where_clause, projection=s.select_clause or None
+        )
+        if s.limit_clause:
+            entry_node = LimitNode(entry_node, s.limit_clause)
+        return entry_node
+    entry_node = FileScanNode(
+        s.from_clause, filter=s.where_clause, columns=_get_scan_columns(s)
+    )
+    entry_node = SortNode(entry_node, s.order_clause)
     if s.limit_clause:
         entry_node = LimitNode(entry_node, s.limit_clause)
     if s.select_clause:
         entry_node = ProjectionNode(entry_node, s.select_clause)
-    return entry_node
+    return _rewrite_top_k(entry_node)
 
 
 def execute_dml(s: AbstractDMLStatement) -> t.List[t.List[t.Any]]:
@@ -264,7 +715,10 @@ def execute_dml(s: AbstractDMLStatement) -> t.List[t.List[t.Any]]:
         entry_node = InsertNode(child, s.into_clause)
     else:
         raise ValueError(f"Received unrecognized AbstractDMLStatement type: {type(s)}")
-    return [r for r in entry_node]
+    try:
+        return [r for batch in entry_node for r in batch]
+    finally:
+        entry_node.close()
     
 
 def execute(s: AbstractStatement) -> t.Optional[t.List[t.List[t.Any]]]:
@@ -0,0 +1,76 @@
+"""Selection kernels that run over a column's encoded bytes.
+
+Kernels are looked up by (op, dtype) from a small fixed library, so only
+recognized predicate shapes over fixed width columns use them; everything else
+is evaluated on decoded values. A kernel takes a bytes buffer and the layout of
+the column's values in it (offset of the first, stride between consecutive
+values, and count) and returns the positions of matching values, ascending,
+without decoding any value.
+"""
+
+
+import typing as t
+
+from toydbms.physical import _UINT32, DType, UInt32
+from toydbms.query import Cmp, Filter, In, Predicate, Table
+
+
+Kernel = t.Callable[[bytes, int, int, int], t.List[int]]
+
+# IN lists longer than this are cheaper to test on decoded values
+MAX_IN_PATTERNS = 8
+
+
+def _find_patterns(patterns: t.Collection[bytes]) -> Kernel:
+    """Matches values equal to any of the encoded patterns by searching the raw
+    bytes (C speed), keeping only hits aligned to a value's start."""
+    def kernel(buff: bytes, start: int, stride: int, count: int) -> t.List[int]:
+        end = start + stride * count
+        positions = []
+        for pattern in patterns:
+            i = buff.find(pattern, start, end)
+            while i != -1:
+                offset = i - start
+                if offset % stride == 0:
+                    positions.append(offset // stride)
+                    i = buff.find(pattern, i + stride, end)
+                else:
+                    i = buff.find(pattern, i + 1, end)
+        if len(patterns) > 1:
+            positions.sort()
+        return positions
+    return kernel
+
+
+def _uint32_equal(values: t.Collection[t.Any]) -> t.Optional[Kernel]:
+    if not all(isinstance(v, int) for v in values):
+        return None
+    # values a UInt32 can't hold never match; there's nothing to search for
+    patterns = {_UINT32.pack(v) for v in values if 0 <= v < 1 << 32}
+    return _find_patterns(patterns)
+
+
+KERNELS: t.Dict[t.Tuple[str, t.Type[DType]], t.Callable[[t.Collection[t.Any]], t.Optional[Kernel]]] = {
+    ("=", UInt32): _uint32_equal,
+    ("in", UInt32): _uint32_equal,
+}
+
+
+def compile_kernel(
+    table: Table,
+    conjunct: t.Union[Filter, Predicate],
+) -> t.Optional[t.Tuple[int, Kernel]]:
+    """Returns (column index, kernel) for a conjunct the library covers, else
+    None."""
+    if isinstance(conjunct, Cmp) and conjunct.op in ("=", "=="):
+        op, values = "=", [conjunct.value]
+    elif isinstance(conjunct, In) and len(conjunct.values) <= MAX_IN_PATTERNS:
+        op, values = "in", list(conjunct.values)
+    else:
+        return None
+    column = conjunct.column_args[0]
+    factory = KERNELS.get((op, dict(table.schema)[column]))
+    kernel = None if factory is None else factory(values)
+    if kernel is None:
+        return None
+    return table.column_index[column], kernel
@@ -1,9 +1,11 @@
 """Physical representation of data for storage."""
 
 
+import itertools
 import struct
 import typing as t
 from abc import ABC, abstractstaticmethod
+from dataclasses import dataclass
 from io import BytesIO
 
 
@@ -20,6 +22,9 @@ class InsufficientSpaceError(ValueError):
 
 # classes for encoding/decoding specific value data types
 class DType(ABC):
+    # struct format character for fixed width dtypes, None for variable width
+    struct_format: t.Optional[str] = None
+
     @abstractstaticmethod
     def marshall(value: t.Any) -> bytes:
         pass
@@ -32,11 +37,38 @@ class DType(ABC):
     def from_str(value: str) -> t.Any:
         pass
 
+    @classmethod
+    def unmarshall_from(cls, buff: bytes, offset: int) -> t.Tuple[t.Any, int]:
+        """Decodes the value at offset in buff, returning it and the offset just
+        past it.
+
+        Subclasses override this to read buff in place; the default goes
+        through unmarshall on a BytesIO.
+        """
+        value_buff = BytesIO(buff[offset:])
+        value = cls.unmarshall(value_buff)
+        return value, offset + value_buff.tell()
+
+    @classmethod
+    def skip_from(cls, buff: bytes, offset: int) -> int:
+        """Returns the offset just past the value at offset, without decoding
+        it where the subclass allows.
+
+        Subclasses override this to avoid decoding values nobody will read.
+        """
+        return cls.unmarshall_from(buff, offset)[1]
+
+
+_UINT16 = struct.Struct("<H")
+_UINT32 = struct.Struct("<I")
+
 
 class UInt32(DType):
+    struct_format = "I"
+
     @staticmethod
     def marshall(value: int) -> bytes:
-        return struct.pack("<I", value)
+        return _UINT32.pack(value)
     
     @staticmethod
     def unmarshall(buff: BytesIO) -> int:
@@ -45,6 +77,14 @@ class UInt32(DType):
     @staticmethod
     def from_str(value: str) -> int:
         return int(value)
+
+    @staticmethod
+    def unmarshall_from(buff: bytes, offset: int) -> t.Tuple[int, int]:
+        return _UINT32.unpack_from(buff, offset)[0], offset + 4
+
+    @staticmethod
+    def skip_from(buff: bytes, offset: int) -> int:
+        return offset + 4
     
 
 class Text(DType):
@@ -55,13 +95,65 @@ class Text(DType):
     
     @staticmethod
     def unmarshall(buff: BytesIO) -> str:
-        data_len = struct.unpack("<B", buff.read(1))[0]
+        data_len = buff.read(1)[0]
         return buff.read(data_len).decode("utf8")
+
+    @staticmethod
+    def unmarshall_from(buff: bytes, offset: int) -> t.Tuple[str, int]:
+        """Decodes the value at offset in buff, returning it and the offset just
+        past it. Reads buff in place, with no BytesIO or struct call."""
+        end = offset + 1 + buff[offset]
+        return buff[offset + 1:end].decode("utf8"), end
     
     @staticmethod
     def from_str(value: str) -> str:
         return value
 
+    @staticmethod
+    def skip_from(buff: bytes, offset: int) -> int:
+        return offset + 1 + buff[offset]
+
+
+@dataclass
+class ColumnBatch:
+    """Struct-of-arrays batch: one value sequence per decoded column index.
+
+    Lets operators work column-at-a-time (e.g. evaluate a filter over one
+    column) and only build row lists for the rows and columns that survive.
+    """
+
+    columns: t.Dict[int, t.Sequence[t.Any]]
+    length: int
+
+    def take(self, positions: t.Sequence[int]) -> "ColumnBatch":
+        return ColumnBatch(
+            {i: [column[k] for k in positions] for i, column in self.columns.items()},
+            len(positions),
+        )
+
+    def rows(self, width: int) -> t.List[t.List[t.Any]]:
+        """Stitches columns into rows of width fields, None for absent columns."""
+        columns = [
+            self.columns[i] if i in self.columns else itertools.repeat(None, self.length)
+            for i in range(width)
+        ]
+        return list(map(list, zip(*columns)))
+
+
+# Precompiled record structs for schemas of only fixed width columns,
+# keyed by the schema's dtypes; None for schemas with variable width columns
+_SCHEMA_STRUCT: t.Dict[t.Tuple[t.Type[DType], ...], t.Optional[struct.Struct]] = {}
+
+
+def _schema_struct(schema: t.List[t.Tuple[str, t.Type[DType]]]) -> t.Optional[struct.Struct]:
+    dtypes = tuple(dtype for _, dtype in schema)
+    if dtypes not in _SCHEMA_STRUCT:
+        _SCHEMA_STRUCT[dtypes] = (
+            struct.Struct("<" + "".join(dtype.struct_format for dtype in dtypes))
+            if all(dtype.struct_format is not None for dtype in dtypes) else None
+        )
+    return _SCHEMA_STRUCT[dtypes]
+
 
 class HeapPage:
     """Object representation of a page in the heap file. 
@@ -75,28 +167,62 @@ class HeapPage:
     - free space
     - records[] (bottom up ordering)
 
+    A read_only page references the buffer it's loaded from (e.g. a memoryview
+    into a larger read) instead of copying it, and can't be inserted into.
+
     TODO: doesn't handle concurrent iterators on same HeapPage.
     """
-    def __init__(self, schema: t.List[t.Tuple[str, t.Type[DType]]], page_size: int = 4096, init_buff: t.Optional[bytes] = None):
+    def __init__(
+            self,
+            schema: t.List[t.Tuple[str, t.Type[DType]]],
+            page_size: int = 4096,
+            init_buff: t.Optional[bytes] = None,
+            read_only: bool = False,
+        ):
         self._schema = schema
+        self._record_struct = _schema_struct(schema)
+        self._all_fields = [True] * len(schema)
+        self._read_only = read_only
         if init_buff is None:
-            self._buff = bytearray(page_size)
+            self._buff = None if read_only else bytearray(page_size)
+            self._num_records = 0
+            self._slots = []
             self._record_pointers_end = 2
             self._records_start = page_size
+            self._iter_idx = 0
+        else:
+            self._buff = None
+            self.reset(init_buff)
+
+    def reset(self, buff: bytes) -> None:
+        """Reloads this page from a serialized page, reusing the object.
+
+        The bytes are copied into the existing buffer when sizes match, so a
+        scan can cycle one HeapPage (and one buffer) through every page. A
+        read_only page keeps a reference to buff instead.
+        """
+        if self._read_only:
+            self._buff = buff
+        elif self._buff is not None and len(self._buff) == len(buff):
+            self._buff[:] = buff
         else:
-            self._buff = bytearray(init_buff)
-            self._record_pointers_end = 2 + 2 * self.num_records
-            self._records_start = self._get_record_start_idx(self.num_records - 1)
+            self._buff = bytearray(buff)
+        # the record count and slot directory are parsed once per page load
+        num_records = _UINT16.unpack_from(buff)[0]
+        self._num_records = num_records
+        self._slots = list(struct.unpack_from(f"<{num_records}H", buff, 2))
+        self._record_pointers_end = 2 + 2 * num_records
+        self._records_start = self._slots[-1] if num_records else len(buff)
         self._iter_idx = 0
 
     def _free_bytes(self) -> int:
         page_size = len(self._buff)
         records_size = page_size - self._records_start
-        return page_size - 2 - 2 * self.num_records - records_size
+        return page_size - 2 - 2 * self._num_records - records_size
 
     @property
     def num_records(self) -> int:
-        return struct.unpack("<H", self._buff[:2])[0]
+        return self._num_records
     
     def _can_fit_record(self, record_bin: bytes) -> bool:
         return 2 + len(record_bin) <= self._free_bytes() 
@@ -110,13 +236,24 @@ class HeapPage:
             dtype.marshall(val)
             for (_, dtype), val in zip(self._schema, record)
         ])
+        self.insert_record_bytes(record_bin)
+
+    def insert_record_bytes(self, record_bin: bytes) -> None:
+        """Optimistic insertion of an already marshalled record.
+
+        Caller must handle InsufficientSpaceError if page is too full.
+        """
+        if self._read_only:
+            raise ValueError("Can't insert into a read-only page")
         if not self._can_fit_record(record_bin):
             raise InsufficientSpaceError
         self._records_start -= len(record_bin)
         self._record_pointers_end += 2
         self._buff[self._records_start:self._records_start+len(record_bin)] = record_bin
-        self._buff[self._record_pointers_end-2:self._record_pointers_end] = struct.pack("<H", self._records_start)
-        self._buff[:2] = struct.pack("<H", self.num_records + 1)
+        self._buff[self._record_pointers_end-2:self._record_pointers_end] = _UINT16.pack(self._records_start)
+        self._slots.append(self._records_start)
+        self._num_records += 1
+        self._buff[:2] = _UINT16.pack(self._num_records)
 
     def marshall(self) -> bytes:
         return bytes(self._buff)
@@ -126,16 +263,368 @@ class HeapPage:
         return self
     
     def _get_record_start_idx(self, record_num: int) -> int:
-        return struct.unpack("<H", self._buff[2+2*record_num:4+2*record_num])[0]
-    
+        return self._slots[record_num]
+
+    def _record_spans(self, record_nums: t.Iterable[int]) -> t.List[t.Tuple[int, int]]:
+        starts = self._slots
+        page_size = len(self._buff)
+        return [(starts[n], page_size if n == 0 else starts[n - 1]) for n in record_nums]
+
     def __next__(self) -> t.List[t.Any]:
         if self._iter_idx >= self.num_records:
             raise StopIteration
         record_start = self._get_record_start_idx(self._iter_idx)
         record_end = len(self._buff) if self._iter_idx == 0 else self._get_record_start_idx(self._iter_idx-1)
         self._iter_idx += 1
-        record_buff = BytesIO(self._buff[record_start:record_end])
+        return self._decode_records([(record_start, record_end)], self._all_fields)[0]
+
+    def _decode_records(
+        self,
+        spans: t.Iterable[t.Tuple[int, int]],
+        needed: t.List[bool],
+    ) -> t.List[t.List[t.Any]]:
+        """Decodes records, given as (start, end) spans, out of the page buffer.
+
+        All-UInt32 schemas unpack each record with one precompiled struct call.
+        Otherwise an offset is walked through each record, with UInt32 and Text
+        decoded inline (no BytesIO, no per-call format parsing) and fields that
+        aren't needed skipped as None; fields after the last needed one aren't
+        walked at all. Other dtypes dispatch to unmarshall_from/skip_from.
+        """
+        buff = self._buff
+        if self._record_struct is not None:
+            unpack_from = self._record_struct.unpack_from
+            return [list(unpack_from(buff, start)) for start, _ in spans]
+        if isinstance(buff, memoryview):
+            # walking variable width fields through a view (read_only pages)
+            # costs more than one copy of the page
+            buff = buff.tobytes()
+        num_walked = max((i + 1 for i, keep in enumerate(needed) if keep), default=0)
+        fields = [
+            (dtype, keep)
+            for (_, dtype), keep in zip(self._schema[:num_walked], needed)
+        ]
+        trailing = [None] * (len(self._schema) - num_walked)
+        unpack_uint32 = _UINT32.unpack_from
+        records = []
+        for record_start, _ in spans:
+            offset = record_start
+            record = []
+            for dtype, keep in fields:
+                if dtype is UInt32:
+                    record.append(unpack_uint32(buff, offset)[0] if keep else None)
+                    offset += 4
+                elif dtype is Text:
+                    data_len = buff[offset]
+                    offset += 1
+                    record.append(buff[offset:offset + data_len].decode("utf8") if keep else None)
+                    offset += data_len
+                elif keep:
+                    value, offset = dtype.unmarshall_from(buff, offset)
+                    record.append(value)
+                else:
+                    offset = dtype.skip_from(buff, offset)
+                    record.append(None)
+            record += trailing
+            records.append(record)
+        return records
+
+    def _unpack_page(self, columns: t.Optional[t.Collection[int]] = None) -> t.Tuple[t.Any, ...]:
+        """Unpacks the fields of a fixed width schema page in one struct call.
+
+        Records are packed back to back from _records_start to the end of the
+        page, last inserted first, so the values come back in that order. If
+        columns is given, the other fields are pad bytes in the format, so
+        only the given columns' values (in schema order) are converted.
+        """
+        if columns is None:
+            record_format = self._record_struct.format[1:]
+        else:
+            record_format = "".join(
+                dtype.struct_format if i in columns else f"{struct.calcsize(dtype.struct_format)}x"
+                for i, (_, dtype) in enumerate(self._schema)
+            )
+        return struct.unpack_from(
+            "<" + record_format * self.num_records, self._buff, self._records_start
+        )
+
+    def read_columns(
+        self,
+        columns: t.Collection[int],
+        record_nums: t.Optional[t.Sequence[int]] = None,
+    ) -> ColumnBatch:
+        """Decodes the given columns of the given records (default all) into a
+        ColumnBatch, skipping the other fields."""
+        if record_nums is None:
+            if self._record_struct is not None and self.num_records:
+                # only the wanted columns are unpacked, so the k-th of them for
+                # record r sits at (n-1-r)*width + k, and each column is a
+                # single strided slice of the page's values
+                columns = sorted(set(columns))
+                values = self._unpack_page(columns)
+                width = len(columns)
+                last = (self.num_records - 1) * width
+                return ColumnBatch(
+                    {i: values[last + k::-width] for k, i in enumerate(columns)},
+                    self.num_records,
+                )
+            record_nums = range(self.num_records)
+        needed = [i in columns for i in range(len(self._schema))]
+        records = self._decode_records(self._record_spans(record_nums), needed)
+        if not records:
+            return ColumnBatch({i: [] for i in columns}, 0)
+        transposed = list(zip(*records))
+        return ColumnBatch({i: transposed[i] for i in columns}, len(records))
+
+    def column_span(self, column: int) -> t.Optional[t.Tuple[int, int, int, bool]]:
+        """Locates a column's encoded values in the page buffer, for kernels
+        that search raw bytes, as (offset, stride, count, reversed).
+
+        Only fixed width schemas have a span. Records are stored last inserted
+        first, so the values are in reverse record order.
+        """
+        if self._record_struct is None:
+            return None
+        field_offset = struct.calcsize(
+            "<" + "".join(dtype.struct_format for _, dtype in self._schema[:column])
+        )
+        return (
+            self._records_start + field_offset,
+            self._record_struct.size,
+            self._num_records,
+            True,
+        )
+
+    def run(self, pipeline: t.Callable[[bytes, t.Sequence[int]], t.List[t.Any]]) -> t.List[t.Any]:
+        """Runs a compiled page pipeline over the buffer and record offsets."""
+        return pipeline(self._buff, self._slots)
+
+    def read_records(self, columns: t.Optional[t.Collection[int]] = None) -> t.List[t.List[t.Any]]:
+        """Decodes every record on the page in one pass.
+
+        Fields whose schema index isn't in columns are skipped over (no utf8
+        decode or int conversion) and left as None, so rows keep the full schema
+        width; all fields are decoded if columns is None. A fixed width schema
+        page is unpacked in one struct call, which jumps over skipped fields.
+        """
+        if self._record_struct is not None:
+            if columns is not None and len(set(columns)) < len(self._schema):
+                return self.read_columns(columns).rows(len(self._schema))
+            values = self._unpack_page()
+            width = len(self._schema)
+            return [
+                list(values[i:i + width])
+                for i in range((self.num_records - 1) * width, -1, -width)
+            ]
+        if columns is None:
+            needed = self._all_fields
+        else:
+            needed = [i in columns for i in range(len(self._schema))]
+        return self._decode_records(self._record_spans(range(self.num_records)), needed)
+
+
+class ColumnarHeapPage:
+    """Page in a heap file with a PAX (partition attributes across) layout.
+
+    Holds the same records as a HeapPage, but groups the values column-wise
+    within the page, so a scan decodes only the bytes of the columns it reads
+    and a fixed width column unpacks with one struct call. Exposes the same
+    interface as HeapPage.
+
+    Layout:
+    - uint16 for num_records
+    - uint16[] for start indexes of each column's values
+    - column values[] (each column packed in record order; Text values keep
+      their length prefix)
+    - free space
+
+    Records being inserted are kept as one bytearray per column, and only
+    laid out into a page buffer by marshall().
+    """
+    def __init__(
+            self,
+            schema: t.List[t.Tuple[str, t.Type[DType]]],
+            page_size: int = 4096,
+            init_buff: t.Optional[bytes] = None,
+            read_only: bool = False,
+        ):
+        self._schema = schema
+        self._read_only = read_only
+        self._page_size = page_size
+        self._header = struct.Struct(f"<{1 + len(schema)}H")
+        self._widths = [
+            None if dtype.struct_format is None else struct.calcsize("<" + dtype.struct_format)
+            for _, dtype in schema
+        ]
+        if init_buff is None:
+            self._buff = None
+            self._num_records = 0
+            self._column_buffs = [bytearray() for _ in schema]
+            self._used_bytes = self._header.size
+        else:
+            self.reset(init_buff)
+        self._iter_rows = iter(())
+
+    def reset(self, buff: bytes) -> None:
+        """Reloads this page from a serialized page, reusing the object.
+
+        As with HeapPage, a read_only page references buff rather than copying
+        it, so it can be a memoryview into a larger read.
+        """
+        self._buff = buff if self._read_only else bytes(buff)
+        self._page_size = len(buff)
+        header = self._header.unpack_from(buff)
+        self._num_records = header[0]
+        self._column_starts = header[1:]
+        # column buffers are only split out of the page if records get inserted
+        self._column_buffs = None
+
+    @property
+    def num_records(self) -> int:
+        return self._num_records
+
+    def _split_columns(self) -> t.List[bytearray]:
+        buff = memoryview(self._buff)
+        ends = [*self._column_starts[1:], self._column_end(len(self._schema) - 1)]
         return [
-            dtype.unmarshall(record_buff)
-            for (_, dtype) in self._schema
+            bytearray(buff[start:end]) for start, end in zip(self._column_starts, ends)
         ]
+
+    def _column_end(self, column: int) -> int:
+        start = self._column_starts[column]
+        width = self._widths[column]
+        if width is not None:
+            return start + width * self._num_records
+        skip_from = self._schema[column][1].skip_from
+        offset = start
+        for _ in range(self._num_records):
+            offset = skip_from(self._buff, offset)
+        return offset
+
+    def _free_bytes(self) -> int:
+        return self._page_size - self._used_bytes
+
+    def insert_record(self, record: t.List[t.Any]) -> None:
+        """Optimistic record insertion.
+
+        Caller must handle InsufficientSpaceError if page is too full.
+        """
+        self._insert_fields([
+            dtype.marshall(val) for (_, dtype), val in zip(self._schema, record)
+        ])
+
+    def insert_record_bytes(self, record_bin: bytes) -> None:
+        """Optimistic insertion of a record marshalled as by HeapPage.
+
+        Caller must handle InsufficientSpaceError if page is too full.
+        """
+        fields = []
+        offset = 0
+        for (_, dtype), width in zip(self._schema, self._widths):
+            if width is not None:
+                size = width
+            else:
+                size = dtype.skip_from(record_bin, offset) - offset
+            fields.append(record_bin[offset:offset + size])
+            offset += size
+        self._insert_fields(fields)
+
+    def _insert_fields(self, fields: t.List[bytes]) -> None:
+        if self._read_only:
+            raise ValueError("Can't insert into a read-only page")
+        if self._column_buffs is None:
+            self._column_buffs = self._split_columns()
+            self._used_bytes = self._header.size + sum(map(len, self._column_buffs))
+        size = sum(map(len, fields))
+        if size > self._free_bytes() or self._num_records == 0xFFFF:
+            raise InsufficientSpaceError
+        for column_buff, field in zip(self._column_buffs, fields):
+            column_buff += field
+        self._num_records += 1
+        self._used_bytes += size
+
+    def marshall(self) -> bytes:
+        if self._column_buffs is None:
+            return bytes(self._buff)
+        column_starts = []
+        offset = self._header.size
+        for column_buff in self._column_buffs:
+            column_starts.append(offset)
+            offset += len(column_buff)
+        return b"".join([
+            self._header.pack(self._num_records, *column_starts),
+            *self._column_buffs,
+            bytes(self._page_size - offset),
+        ])
+
+    def __iter__(self):
+        self._iter_rows = iter(self.read_records())
+        return self
+
+    def __next__(self) -> t.List[t.Any]:
+        return next(self._iter_rows)
+
+    def _read_column(self, column: int) -> t.Sequence[t.Any]:
+        dtype = self._schema[column][1]
+        buff = self._buff
+        offset = self._column_starts[column]
+        if dtype.struct_format is not None:
+            return struct.unpack_from(
+                "<" + dtype.struct_format * self._num_records, buff, offset
+            )
+        if isinstance(buff, memoryview):
+            # decoding variable width values through a view (read_only pages)
+            # costs more than one copy of the page
+            buff = buff.tobytes()
+        values = []
+        if dtype is Text:
+            for _ in range(self._num_records):
+                data_len = buff[offset]
+                offset += 1
+                values.append(buff[offset:offset + data_len].decode("utf8"))
+                offset += data_len
+        else:
+            unmarshall_from = dtype.unmarshall_from
+            for _ in range(self._num_records):
+                value, offset = unmarshall_from(buff, offset)
+                values.append(value)
+        return values
+
+    def read_columns(
+        self,
+        columns: t.Collection[int],
+        record_nums: t.Optional[t.Sequence[int]] = None,
+    ) -> ColumnBatch:
+        """Decodes the given columns of the given records (default all) into a
+        ColumnBatch, without touching the bytes of other columns."""
+        if self._column_buffs is not None:
+            self.reset(self.marshall())
+        if record_nums is None:
+            return ColumnBatch({i: self._read_column(i) for i in columns}, self._num_records)
+        batch = {}
+        for i in columns:
+            width = self._widths[i]
+            if width is None:
+                column = self._read_column(i)
+                batch[i] = [column[k] for k in record_nums]
+            else:
+                # unpack just the selected values of a fixed width column
+                unpack_from = struct.Struct("<" + self._schema[i][1].struct_format).unpack_from
+                start = self._column_starts[i]
+                batch[i] = [unpack_from(self._buff, start + width * k)[0] for k in record_nums]
+        return ColumnBatch(batch, len(record_nums))
+
+    def column_span(self, column: int) -> t.Optional[t.Tuple[int, int, int, bool]]:
+        """Locates a fixed width column's encoded values in the page buffer, for
+        kernels that search raw bytes, as (offset, stride, count, reversed)."""
+        width = self._widths[column]
+        if width is None or self._column_buffs is not None:
+            return None
+        return self._column_starts[column], width, self._num_records, False
+
+    def read_records(self, columns: t.Optional[t.Collection[int]] = None) -> t.List[t.List[t.Any]]:
+        """Decodes every record on the page, leaving fields whose schema index
+        isn't in columns as None. All fields are decoded if columns is None."""
+        if columns is None:
+            columns = range(len(self._schema))
+        return self.read_columns(columns).rows(len(self._schema))
@@ -0,0 +1,259 @@
+"""Compiles query fragments (filters, projections, page scans) into generated
+Python code, so per-row work runs as inline expressions in a single loop
+rather than through operator and predicate calls."""
+
+
+import dis
+import re
+import typing as t
+
+from toydbms.physical import _UINT32, ColumnBatch, Text, UInt32
+from toydbms.query import (
+    And,
+    Between,
+    Cmp,
+    Filter,
+    In,
+    Predicate,
+    Table,
+    bind_expression,
+    bind_function,
+)
+
+
+Batch = t.List[t.List[t.Any]]
+
+
+def literal_contains_needle(predicate: t.Callable[..., bool]) -> t.Optional[str]:
+    """Returns NEEDLE if predicate is exactly `lambda x: NEEDLE in x`, else None."""
+    code = getattr(predicate, "__code__", None)
+    if code is None or code.co_argcount != 1 or code.co_kwonlyargcount != 0:
+        return None
+    ops = [
+        i for i in dis.get_instructions(code)
+        if i.opname not in ("RESUME", "NOP", "CACHE")
+    ]
+    if (
+        len(ops) == 4
+        and ops[0].opname == "LOAD_CONST" and isinstance(ops[0].argval, str)
+        and ops[1].opname.startswith("LOAD_FAST") and ops[1].argval == code.co_varnames[0]
+        and ops[2].opname == "CONTAINS_OP" and ops[2].arg == 0
+        and ops[3].opname == "RETURN_VALUE"
+    ):
+        return ops[0].argval
+    return None
+
+
+def _filter_condition(
+    filter: t.Union[Filter, Predicate],
+    args: t.List[str],
+    consts: t.List[t.Any],
+) -> str:
+    """Returns filter as an inline condition over args, the expressions for its
+    column args' values, appending the constants it uses to consts.
+
+    A Predicate is inlined as its own expression and a `lambda x: "literal" in
+    x` Filter as an `in` test, so no Python frame is entered per row; any
+    other Filter becomes a call of its predicate.
+    """
+    if isinstance(filter, Predicate):
+        return filter.source(dict(zip(filter.column_args, args)), consts)
+    needle = literal_contains_needle(filter.predicate) if len(args) == 1 else None
+    if needle is not None:
+        consts.append(needle)
+        return f"c{len(consts) - 1} in {args[0]}"
+    consts.append(filter.predicate)
+    return f"c{len(consts) - 1}({', '.join(args)})"
+
+
+def _conjuncts(filter: t.Union[Filter, Predicate]) -> t.List[t.Union[Filter, Predicate]]:
+    """Flattens nested Ands into the list of filters that must all hold."""
+    if isinstance(filter, And):
+        return [c for operand in filter.operands for c in _conjuncts(operand)]
+    return [filter]
+
+
+def _conjunct_rank(table: Table, conjunct: t.Union[Filter, Predicate]) -> t.Tuple[int, int, int]:
+    """Sort key putting cheap and likely selective conjuncts first.
+
+    Equality before IN before ranges before anything else, with opaque Filter
+    functions (a Python call per row) last; then fixed width (int) columns
+    before Text, then fewer columns.
+    """
+    if isinstance(conjunct, Cmp):
+        kind = 0 if conjunct.op in ("=", "==") else 3 if conjunct.op == "!=" else 2
+    elif isinstance(conjunct, In):
+        kind = 1
+    elif isinstance(conjunct, Between):
+        kind = 2
+    elif isinstance(conjunct, Predicate):
+        kind = 3
+    else:
+        kind = 4
+    dtypes = dict(table.schema)
+    fixed_width = all(dtypes[col].struct_format is not None for col in conjunct.column_args)
+    return kind, 0 if fixed_width else 1, len(conjunct.column_args)
+
+
+def order_conjuncts(table: Table, filter: t.Union[Filter, Predicate]) -> t.List[t.Union[Filter, Predicate]]:
+    """Splits filter into conjuncts in evaluation order (stable for ties)."""
+    return sorted(_conjuncts(filter), key=lambda c: _conjunct_rank(table, c))
+
+
+def compile_batch_plan(
+    table: Table,
+    filter: t.Optional[t.Union[Filter, Predicate]] = None,
+    projection: t.Optional[t.List[str]] = None,
+) -> t.Callable[[Batch], Batch]:
+    """Generates a fused filter + projection over one batch.
+
+    Column indexes are inlined as constants into a single comprehension, so a
+    row costs one loop iteration instead of a call per operator. The code is
+    compiled once per plan shape. Conjuncts are tested cheapest first, and
+    `and` skips the rest for a row once one fails.
+    """
+    consts = []
+    cond = ""
+    if filter is not None:
+        conds = []
+        for conjunct in order_conjuncts(table, filter):
+            args = [f"row[{table.column_index[col]}]" for col in conjunct.column_args]
+            conds.append(f"({_filter_condition(conjunct, args, consts)})")
+        cond = f" if {' and '.join(conds)}"
+    out = "row"
+    if projection is not None:
+        out = "[" + ", ".join(f"row[{table.column_index[col]}]" for col in projection) + "]"
+    return bind_expression(f"[{out} for row in batch{cond}]", ["batch"], consts)
+
+
+def compile_selection(
+    table: Table,
+    filter: t.Union[Filter, Predicate],
+) -> t.Callable[[ColumnBatch], t.List[int]]:
+    """Generates a function returning the positions in a ColumnBatch that pass
+    filter, reading only the filter's argument columns."""
+    arg_idxs = [table.column_index[col] for col in filter.column_args]
+    args = [f"v{i}" for i in arg_idxs]
+    consts = []
+    cond = _filter_condition(filter, args, consts)
+    if not arg_idxs:
+        loop = "k in range(cb.length)"
+    elif len(arg_idxs) == 1:
+        loop = f"k, {args[0]} in enumerate(cb.columns[{arg_idxs[0]}])"
+    else:
+        columns = ", ".join(f"cb.columns[{i}]" for i in arg_idxs)
+        loop = f"k, ({', '.join(args)}) in enumerate(zip({columns}))"
+    return bind_expression(f"[k for {loop} if {cond}]", ["cb"], consts)
+
+
+def compile_pipeline(
+    table: Table,
+    filter: t.Optional[t.Union[Filter, Predicate]] = None,
+    columns: t.Optional[t.Collection[str]] = None,
+    projection: t.Optional[t.List[str]] = None,
+) -> t.Optional[t.Callable[[bytes, t.Sequence[int]], Batch]]:
+    """Generates one function that decodes, filters and projects a row-layout
+    page's records, given the page buffer and its record start offsets.
+
+    The record layout is unrolled into straight-line code: every field offset
+    is an expression over the previous Text lengths, filter columns are decoded
+    first and each conjunct (cheapest first) rejects a record before any other
+    field of it is decoded, and output fields are decoded straight into the
+    projected (or full width, None for unread columns) row. Fields after the
+    last one needed are never walked. A column that only one multi-column
+    Predicate reads is decoded inside its condition, so a short-circuiting
+    `and`/`or` can skip it too.
+
+    Returns None when the table's layout or dtypes aren't supported (only row
+    pages of UInt32 and Text columns are), or for all UInt32 schemas, whose
+    pages HeapPage unpacks whole in one struct call.
+    """
+    dtypes = [dtype for _, dtype in table.schema]
+    if (
+        table.layout != "row"
+        or any(dtype not in (UInt32, Text) for dtype in dtypes)
+        or Text not in dtypes
+    ):
+        return None
+    column_index = table.column_index
+    if projection is not None:
+        out_idxs = [column_index[col] for col in projection]
+    elif columns is not None:
+        out_idxs = sorted(column_index[col] for col in columns)
+    else:
+        out_idxs = list(range(len(table.schema)))
+    conjuncts = [] if filter is None else order_conjuncts(table, filter)
+    needed = set(out_idxs).union(
+        *[{column_index[col] for col in c.column_args} for c in conjuncts]
+    )
+    # walk the record: each field's value is an expression over the record
+    # start o0 or the offset o1, o2, ... just past an earlier Text field.
+    # Offsets are only computed once a field after them is first read
+    # c0 is the UInt32 unpacker; the conjuncts' constants follow it
+    consts = [_UINT32.unpack_from]
+    walk = []
+    values = {}
+    walk_needed = {}
+    base, delta = "o0", 0
+    for i, (_, dtype) in enumerate(table.schema[:max(needed, default=-1) + 1]):
+        walk_needed[i] = len(walk)
+        if dtype is UInt32:
+            values[i] = f"c0(buff, {base} + {delta})[0]" if delta else f"c0(buff, {base})[0]"
+            delta += 4
+        else:
+            end = f"o{len(walk) + 1}"
+            length = f"buff[{base} + {delta}]" if delta else f"buff[{base}]"
+            walk.append(f"{end} = {base} + {delta + 1} + {length}")
+            values[i] = f'buff[{base} + {delta + 1}:{end}].decode("utf8")'
+            base, delta = end, 0
+            walk_needed[i] = len(walk)
+    body = []
+    walked = 0
+    def read(i: int) -> str:
+        nonlocal walked
+        body.extend(walk[walked:walk_needed[i]])
+        walked = max(walked, walk_needed[i])
+        return values[i]
+
+    decoded = set()
+    for n, conjunct in enumerate(conjuncts):
+        idxs = [column_index[col] for col in conjunct.column_args]
+        cond = _filter_condition(conjunct, [f"v{i}" for i in idxs], consts[:])
+        # a multi-column Predicate can short-circuit before reaching some of
+        # its columns: one it reads once and that nothing after it needs is
+        # decoded inline in the condition rather than up front
+        later = set(out_idxs).union(
+            *[{column_index[col] for col in c.column_args} for c in conjuncts[n + 1:]]
+        )
+        inline = {}
+        if isinstance(conjunct, Predicate) and len(set(idxs)) > 1:
+            for i in idxs:
+                if (
+                    i not in decoded
+                    and i not in later
+                    and len(re.findall(rf"\bv{i}\b", cond)) == 1
+                ):
+                    inline[i] = read(i)
+        for i in idxs:
+            if i not in decoded and i not in inline:
+                body.append(f"v{i} = {read(i)}")
+                decoded.add(i)
+        args = [inline.get(i, f"v{i}") for i in idxs]
+        cond = _filter_condition(conjunct, args, consts)
+        body.append(f"if not ({cond}):")
+        body.append("    continue")
+    if projection is None:
+        out_idxs = [
+            i if i in out_idxs or i in decoded else None for i in range(len(table.schema))
+        ]
+    fields = [
+        "None" if i is None else f"v{i}" if i in decoded else read(i)
+        for i in out_idxs
+    ]
+    body.append(f"out.append([{', '.join(fields)}])")
+    src = "\n".join(
+        ["out = []", "for o0 in starts:"]
+        + [f"    {line}" for line in body]
+        + ["return out"]
+    )
+    return bind_function(src, ["buff", "starts"], consts)
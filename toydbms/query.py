@@ -1,24 +1,107 @@
 """Abstract representation of a query."""
 
 
+import functools
+import os
 import typing as t
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import cached_property
 
-from toydbms.physical import DType
+from toydbms.physical import ColumnarHeapPage, DType, HeapPage
+
+
+# page classes for each supported on-disk table layout
+PAGE_LAYOUTS = {
+    "row": HeapPage,
+    "pax": ColumnarHeapPage,
+}
 
 
 @dataclass
 class Table:
-    """Represents an on-disk table for an abstract query."""
+    """Represents an on-disk table for an abstract query.
+
+    layout picks the page format: "row" stores each record's fields together
+    (HeapPage), "pax" groups values column-wise within each page
+    (ColumnarHeapPage), which suits scans touching few columns.
+    """
 
     schema: t.List[t.Tuple[str, t.Type[DType]]]
     data_path: str
+    layout: str = "row"
+    _fd: t.Optional[int] = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.layout not in PAGE_LAYOUTS:
+            raise ValueError(f"Unrecognized table layout: {self.layout}")
 
     @property
+    def page_type(self) -> t.Type[HeapPage]:
+        return PAGE_LAYOUTS[self.layout]
+
+    @cached_property
     def columns(self) -> t.List[str]:
         return [c for c, _ in self.schema]
 
+    @cached_property
+    def column_index(self) -> t.Dict[str, int]:
+        """Maps column name to its position, for O(1) lookups at plan time."""
+        return {c: i for i, (c, _) in enumerate(self.schema)}
+
+    def check_row_widths(self, rows: t.List[t.List[t.Any]]) -> None:
+        """Raises ValueError unless every row has one value per column.
+
+        Batches are transposed with zip, which would otherwise truncate every
+        row in the batch to the shortest one.
+        """
+        width = len(self.schema)
+        if rows and set(map(len, rows)) != {width}:
+            row = next(row for row in rows if len(row) != width)
+            raise ValueError(f"Expected {width} values per row, got {len(row)}: {row!r}")
+
+    def encode_batch(self, rows: t.List[t.List[t.Any]]) -> t.List[bytes]:
+        """Marshalls typed rows into record bytes ready for HeapPage insertion.
+
+        Encodes column-at-a-time, mapping each dtype's marshall over a whole
+        column, then joins each row's fields.
+        """
+        self.check_row_widths(rows)
+        columns = [
+            list(map(dtype.marshall, column))
+            for (_, dtype), column in zip(self.schema, zip(*rows))
+        ]
+        return list(map(b"".join, zip(*columns)))
+
+    @property
+    def fd(self) -> int:
+        """Read/write descriptor for the data file, opened lazily and reused.
+
+        Supports positional os.pread/os.pwrite, so statements against the same
+        table don't each pay an open/seek/close. A cached descriptor is
+        reopened if the file at data_path has since been replaced (e.g.
+        recreated through another Table), so writes never go to a stale file.
+        """
+        if self._fd is not None:
+            opened = os.fstat(self._fd)
+            try:
+                current = os.stat(self.data_path)
+            except FileNotFoundError:
+                current = None
+            if current is None or (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino):
+                self.close()
+        if self._fd is None:
+            self._fd = os.open(self.data_path, os.O_RDWR)
+        return self._fd
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        self.close()
+
 
 @dataclass
 class Filter:
@@ -32,6 +115,161 @@ class Filter:
     predicate: t.Callable[..., bool]
 
 
+class Predicate(ABC):
+    """Structured selection predicate, usable anywhere a Filter is.
+
+    Like a Filter, it has column_args and a row-at-a-time predicate function,
+    but its shape is visible to the executor, which compiles it into inline
+    expressions over column values instead of calling a function per row.
+    """
+
+    @property
+    @abstractmethod
+    def column_args(self) -> t.List[str]:
+        pass
+
+    @abstractmethod
+    def source(self, args: t.Mapping[str, str], consts: t.List[t.Any]) -> str:
+        """Returns this predicate as a Python expression.
+
+        args maps each column name to the expression for its value. Constants
+        are appended to consts and referenced by name as c0, c1, ...
+        """
+        pass
+
+    @cached_property
+    def predicate(self) -> t.Callable[..., bool]:
+        params = [f"a{i}" for i in range(len(self.column_args))]
+        consts = []
+        expression = self.source(dict(zip(self.column_args, params)), consts)
+        return bind_expression(expression, params, consts)
+
+
+@functools.lru_cache(maxsize=None)
+def _function_factory(body: str, params: t.Tuple[str, ...], num_consts: int) -> t.Callable[..., t.Callable[..., t.Any]]:
+    """Compiles a function body once per source text; constants are bound per
+    call."""
+    src = (
+        f"def make({', '.join(f'c{i}' for i in range(num_consts))}):\n"
+        f"    def function({', '.join(params)}):\n"
+        + "".join(f"        {line}\n" for line in body.splitlines())
+        + "    return function\n"
+    )
+    namespace = {}
+    exec(compile(src, "<generated>", "exec"), namespace)
+    return namespace["make"]
+
+
+def bind_function(body: str, params: t.List[str], consts: t.List[t.Any]) -> t.Callable[..., t.Any]:
+    """Returns a function of params running body (lines of Python source,
+    indented relative to the function), with constants c0, c1, ... bound as
+    closure variables. Each distinct body is compiled only once."""
+    return _function_factory(body, tuple(params), len(consts))(*consts)
+
+
+def bind_expression(expression: str, params: t.List[str], consts: t.List[t.Any]) -> t.Callable[..., t.Any]:
+    """Returns a function of params that evaluates expression, with constants
+    c0, c1, ... bound as closure variables."""
+    return bind_function(f"return {expression}", params, consts)
+
+
+def _add_const(consts: t.List[t.Any], value: t.Any) -> str:
+    consts.append(value)
+    return f"c{len(consts) - 1}"
+
+
+_CMP_OPS = {"=": "==", "==": "==", "!=": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+
+
+@dataclass
+class Cmp(Predicate):
+    """column op value, with op one of =, !=, <, <=, >, >=."""
+
+    column: str
+    op: str
+    value: t.Any
+
+    def __post_init__(self):
+        if self.op not in _CMP_OPS:
+            raise ValueError(f"Unrecognized comparison operator: {self.op}")
+
+    @property
+    def column_args(self) -> t.List[str]:
+        return [self.column]
+
+    def source(self, args: t.Mapping[str, str], consts: t.List[t.Any]) -> str:
+        return f"{args[self.column]} {_CMP_OPS[self.op]} {_add_const(consts, self.value)}"
+
+
+@dataclass
+class Between(Predicate):
+    """low <= column <= high."""
+
+    column: str
+    low: t.Any
+    high: t.Any
+
+    @property
+    def column_args(self) -> t.List[str]:
+        return [self.column]
+
+    def source(self, args: t.Mapping[str, str], consts: t.List[t.Any]) -> str:
+        low = _add_const(consts, self.low)
+        high = _add_const(consts, self.high)
+        return f"{low} <= {args[self.column]} <= {high}"
+
+
+@dataclass
+class In(Predicate):
+    """column is one of values."""
+
+    column: str
+    values: t.Collection[t.Any]
+
+    @property
+    def column_args(self) -> t.List[str]:
+        return [self.column]
+
+    def source(self, args: t.Mapping[str, str], consts: t.List[t.Any]) -> str:
+        return f"{args[self.column]} in {_add_const(consts, frozenset(self.values))}"
+
+
+@dataclass
+class And(Predicate):
+    """All of operands hold."""
+
+    operands: t.List[Predicate]
+
+    def __post_init__(self):
+        if not self.operands:
+            raise ValueError("And needs at least one operand")
+
+    @property
+    def column_args(self) -> t.List[str]:
+        return list(dict.fromkeys(col for p in self.operands for col in p.column_args))
+
+    def source(self, args: t.Mapping[str, str], consts: t.List[t.Any]) -> str:
+        return " and ".join(f"({p.source(args, consts)})" for p in self.operands)
+
+
+@dataclass
+class Or(Predicate):
+    """Any of operands holds."""
+
+    operands: t.List[Predicate]
+
+    def __post_init__(self):
+        if not self.operands:
+            raise ValueError("Or needs at least one operand")
+
+    @property
+    def column_args(self) -> t.List[str]:
+        return list(dict.fromkeys(col for p in self.operands for col in p.column_args))
+
+    def source(self, args: t.Mapping[str, str], consts: t.List[t.Any]) -> str:
+        return " or ".join(f"({p.source(args, consts)})" for p in self.operands)
+
+
 @dataclass
 class SortColumn:
     """Represents a sorting column for an abstract query."""
@@ -86,7 +324,7 @@ class AbstractQuery(AbstractDMLStatement):
     """Abstract SELECT statement, as if parsed from SQL"""
     from_clause: Table
     select_clause: t.Optional[t.List[str]] = None
-    where_clause: t.Optional[Filter] = None
+    where_clause: t.Optional[t.Union[Filter, Predicate]] = None
     order_clause: t.Optional[t.List[SortColumn]] = None
     limit_clause: t.Optional[int] = None
 
@@ -96,7 +334,8 @@ class AbstractInsert(AbstractDMLStatement):
     into_clause: Table
     # No nulls yet, require len(inner lists) == len(Table.schema)
     # Require values as strings, as if parsed from a SQL statement.
+    # Any iterable of rows is accepted and consumed lazily during the insert.
     # Exactly one of values clause or from clause is required
-    values_clause: t.Optional[t.List[t.List[str]]] = None
+    values_clause: t.Optional[t.Iterable[t.List[str]]] = None
     from_clause: t.Optional[AbstractQuery] = None
 